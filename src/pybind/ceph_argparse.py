@@ -12,14 +12,36 @@ modify it under the terms of the GNU General Public
 License version 2, as published by the Free Software
 Foundation.  See file COPYING.
 """
-import copy
+import bisect
+import cStringIO
 import json
 import os
+import re
 import socket
 import stat
 import sys
 import types
-import uuid
+
+# streaming the command descriptions only pays with one of ijson's yajl
+# backends; its pure-python one is much slower than json.loads
+try:
+    from ijson.common import JSONError as IJSONError
+    try:
+        import ijson.backends.yajl2_c as ijson
+    except ImportError:
+        import ijson.backends.yajl2_cffi as ijson
+except ImportError:
+    ijson = None
+
+# a UUID's 32 hex digits, once any urn:/uuid: prefix, braces and dashes
+# have been stripped
+_UUID_RE = re.compile(r'\A[0-9a-fA-F]{32}\Z')
+
+# [+|-]decimal or [+|-]0xhex; group 1 is set for hex
+_INT_RE = re.compile(r'\A[+-]?(?:(0[xX][0-9a-fA-F]+)|[0-9]+)\Z')
+
+# the usual json_command() target, osd.N; group 1 is N
+_OSD_TARGET_RE = re.compile(r'\Aosd\.([0-9]+)\Z')
 
 class ArgumentError(Exception):
     """
@@ -77,12 +99,26 @@ class CephArgtype(object):
         """
         Run validation against given string s (generally one word);
         partial means to accept partial string matches (begins-with).
-        If cool, set self.val to the value that should be returned
-        (a copy of the input string, or a numeric or boolean interpretation
-        thereof, for example), and return True
-        if not, throw ArgumentError(msg-as-to-why)
+        If cool, return the value that should be used (a copy of the
+        input string, or a numeric or boolean interpretation thereof,
+        for example); if not, throw ArgumentError(msg-as-to-why).
+        The instance itself is not modified, so one can be used for
+        any number of validations.
+        """
+        return s
+
+    def check(self, s, partial=False):
         """
-        self.val = s
+        Like valid(), but just return whether s is acceptable instead
+        of raising ArgumentError if it isn't.  For use when looking for
+        the best-matching signature, where most words won't match;
+        subclasses for which that's common should override this with
+        something that doesn't need to raise an exception.
+        """
+        try:
+            self.valid(s, partial)
+        except Exception:
+            return False
         return True
 
     def __repr__(self):
@@ -119,18 +155,20 @@ class CephInt(CephArgtype):
             self.range = map(long, self.range)
 
     def valid(self, s, partial=False):
-        try:
-            val = long(s)
-        except ValueError:
+        m = _INT_RE.match(s)
+        if not m:
             raise ArgumentValid("{0} doesn't represent an int".format(s))
+        if m.group(1):
+            val = long(s, 16)
+        else:
+            val = long(s)
         if len(self.range) == 2:
             if val < self.range[0] or val > self.range[1]:
                 raise ArgumentValid("{0} not in range {1}".format(val, self.range))
         elif len(self.range) == 1:
             if val < self.range[0]:
                 raise ArgumentValid("{0} not in range {1}".format(val, self.range))
-        self.val = val
-        return True
+        return val
 
     def __str__(self):
         r = ''
@@ -165,8 +203,7 @@ class CephFloat(CephArgtype):
         elif len(self.range) == 1:
             if val < self.range[0]:
                 raise ArgumentValid("{0} not in range {1}".format(val, self.range))
-        self.val = val
-        return True
+        return val
 
     def __str__(self):
         r = ''
@@ -182,13 +219,17 @@ class CephString(CephArgtype):
     """
     def __init__(self, badchars=''):
         self.badchars = badchars
+        self.badre = None
+        if badchars:
+            self.badre = re.compile('[' + re.escape(badchars) + ']')
 
     def valid(self, s, partial=False):
-        for c in self.badchars:
-            if c in s:
-                raise ArgumentFormat("bad char {0} in {1}".format(c, s))
-        self.val = s
-        return True
+        if self.badre:
+            m = self.badre.search(s)
+            if m:
+                raise ArgumentFormat("bad char {0} in {1}".format(m.group(),
+                                                                   s))
+        return s
 
     def __str__(self):
         b = ''
@@ -204,8 +245,7 @@ class CephSocketpath(CephArgtype):
         mode = os.stat(s).st_mode
         if not stat.S_ISSOCK(mode):
             raise ArgumentValid('socket path {0} is not a socket'.format(s))
-        self.val = s
-        return True
+        return s
     def __str__(self):
         return '<admin-socket-path>'
 
@@ -214,49 +254,42 @@ class CephIPAddr(CephArgtype):
     IP address (v4 or v6) with optional port
     """
     def valid(self, s, partial=False):
-        # parse off port, use socket to validate addr
-        type = 6
+        # parse off port, use socket to validate addr.  [v6]:port,
+        # v6 (two or more colons, no port), or v4[:port]
+        p = None
         if s.startswith('['):
-            type = 6
-        elif s.find('.') != -1:
-            type = 4
-        if type == 4:
-            port = s.find(':')
-            if (port != -1):
-                a = s[:port]
-                p = s[port+1:]
-                if int(p) > 65535:
-                    raise ArgumentValid('{0}: invalid IPv4 port'.format(p))
-            else:
-                a = s
-                p = None
-            try:
-                socket.inet_pton(socket.AF_INET, a)
-            except:
-                raise ArgumentValid('{0}: invalid IPv4 address'.format(a))
+            end = s.find(']')
+            if end == -1:
+                raise ArgumentFormat('{0} missing terminating ]'.format(s))
+            a = s[1:end]
+            rest = s[end+1:]
+            if rest:
+                if not rest.startswith(':'):
+                    raise ArgumentFormat('{0}: junk after ]'.format(s))
+                p = rest[1:]
+            family = socket.AF_INET6
+        elif s.count(':') > 1:
+            a = s
+            family = socket.AF_INET6
         else:
-            # v6
-            if s.startswith('['):
-                end = s.find(']')
-                if end == -1:
-                    raise ArgumentFormat('{0} missing terminating ]'.format(s))
-                if s[end+1] == ':':
-                    try:
-                        p = int(s[end+2])
-                    except:
-                        raise ArgumentValid('{0}: bad port number'.format(s))
-                a = s[1:end]
-            else:
-                a = s
+            a, sep, p = s.partition(':')
+            if not sep:
                 p = None
-            try:
-                socket.inet_pton(socket.AF_INET6, a)
-            except:
+            family = socket.AF_INET
+        try:
+            socket.inet_pton(family, a)
+        except:
+            if family == socket.AF_INET6:
                 raise ArgumentValid('{0} not valid IPv6 address'.format(s))
-        if p is not None and long(p) > 65535:
-            raise ArgumentValid("{0} not a valid port number".format(p))
-        self.val = s
-        return True
+            raise ArgumentValid('{0}: invalid IPv4 address'.format(a))
+        if p is not None:
+            try:
+                port = int(p)
+            except ValueError:
+                raise ArgumentValid('{0}: bad port number'.format(s))
+            if port < 0 or port > 65535:
+                raise ArgumentValid("{0} not a valid port number".format(p))
+        return s
 
     def __str__(self):
         return '<IPaddr[:port]>'
@@ -266,11 +299,12 @@ class CephEntityAddr(CephIPAddr):
     EntityAddress, that is, IP address/nonce
     """
     def valid(self, s, partial=False):
-        ip, nonce = s.split('/')
-        if not super(self.__class__, self).valid(ip):
-            raise ArgumentValid('CephEntityAddr {0}: ip address invalid'.format(s))
-        self.val = s
-        return True
+        ip, sep, nonce = s.rpartition('/')
+        if not sep:
+            raise ArgumentFormat('CephEntityAddr {0}: no /nonce'.format(s))
+        # ip may carry a port, so it's the full CephIPAddr syntax
+        CephIPAddr.valid(self, ip)
+        return s
 
     def __str__(self):
         return '<EntityAddr>'
@@ -288,8 +322,7 @@ class CephObjectname(CephArgtype):
     present in pairs, and then could be checked for presence
     """
     def valid(self, s, partial=False):
-        self.val = s
-        return True
+        return s
 
     def __str__(self):
         return '<objectname>'
@@ -299,17 +332,16 @@ class CephPgid(CephArgtype):
     pgid, in form N.xxx (N = pool number, xxx = hex pgnum)
     """
     def valid(self, s, partial=False):
-        if s.find('.') == -1:
+        poolid, sep, pgnum = s.partition('.')
+        if not sep:
             raise ArgumentFormat('pgid has no .')
-        poolid, pgnum = s.split('.')
-        if poolid < 0:
-            raise ArgumentFormat('pool {0} < 0'.format(poolid))
+        if not poolid.isdigit():
+            raise ArgumentFormat('pool {0} not a non-negative integer'.format(poolid))
         try:
             pgnum = int(pgnum, 16)
         except:
             raise ArgumentFormat('pgnum {0} not hex integer'.format(pgnum))
-        self.val = s
-        return True
+        return s
 
     def __str__(self):
         return '<pgid>'
@@ -321,19 +353,21 @@ class CephName(CephArgtype):
     id is a base10 int, if type == osd, or a string otherwise
 
     Also accept '*'
+
+    valid() also leaves the parsed type and id in self.nametype and
+    self.nameid, for callers that want them.
     """
     def valid(self, s, partial=False):
         if s == '*':
-            self.val = s
             self.nametype = None
             self.nameid = None
-            return True
-        if s.find('.') == -1:
+            return s
+        t, sep, i = s.partition('.')
+        if not sep:
             raise ArgumentFormat('CephName: no . in {0}'.format(s))
         else:
-            t, i = s.split('.')
             if not t in ('osd', 'mon', 'client', 'mds'):
-                raise ArgumentValid('unknown type ' + self.t)
+                raise ArgumentValid('unknown type ' + t)
             if t == 'osd':
                 if i != '*':
                     try:
@@ -341,9 +375,8 @@ class CephName(CephArgtype):
                     except:
                         raise ArgumentFormat('osd id ' + i + ' not integer')
             self.nametype = t
-        self.val = s
         self.nameid = i
-        return True
+        return s
 
     def __str__(self):
         return '<name (type.id)>'
@@ -356,25 +389,22 @@ class CephOsdName(CephArgtype):
     """
     def valid(self, s, partial=False):
         if s == '*':
-            self.val = s
             self.nametype = None
             self.nameid = None
-            return True
-        if s.find('.') != -1:
-            t, i = s.split('.')
-        else:
+            return s
+        t, sep, i = s.partition('.')
+        if not sep:
             t = 'osd'
             i = s
         if t != 'osd':
-            raise ArgumentValid('unknown type ' + self.t)
+            raise ArgumentValid('unknown type ' + t)
         try:
             i = int(i)
         except:
             raise ArgumentFormat('osd id ' + i + ' not integer')
         self.nametype = t
         self.nameid = i
-        self.val = i
-        return True
+        return i
 
     def __str__(self):
         return '<osdname (id|osd.id)>'
@@ -385,40 +415,51 @@ class CephChoices(CephArgtype):
     """
     def __init__(self, strings='', **kwargs):
         self.strings=strings.split('|')
+        self.stringset = frozenset(self.strings)
 
     def valid(self, s, partial=False):
         if not partial:
-            if not s in self.strings:
+            if s not in self.stringset:
                 # show as __str__ does: {s1|s2..}
                 raise ArgumentValid("{0} not in {1}".format(s, self))
-            self.val = s
-            return True
+            return s
 
         # partial
         for t in self.strings:
             if t.startswith(s):
-                self.val = s
+                return s
+        raise ArgumentValid("{0} not in {1}".format(s, self))
+
+    def check(self, s, partial=False):
+        if not partial:
+            return s in self.stringset
+        for t in self.strings:
+            if t.startswith(s):
                 return True
-        raise ArgumentValid("{0} not in {1}".  format(s, self))
+        return False
 
     def __str__(self):
-        if len(self.strings) == 1:
-            return '{0}'.format(self.strings[0])
-        else:
-            return '{0}'.format('|'.join(self.strings))
+        return '|'.join(self.strings)
 
 class CephFilepath(CephArgtype):
     """
-    Openable file
+    Openable (writable) file.  Checked with access(2) rather than by
+    opening it, so that validation doesn't create the file.
     """
     def valid(self, s, partial=False):
-        try:
-            f = open(s, 'a+')
-        except Exception as e:
-            raise ArgumentValid('can\'t open {0}: {1}'.format(s, e))
-        f.close()
-        self.val = s
-        return True
+        if not s:
+            raise ArgumentValid('can\'t open {0}: empty path'.format(s))
+        if os.path.isdir(s):
+            raise ArgumentValid('can\'t open {0}: is a directory'.format(s))
+        if os.path.exists(s):
+            if not os.access(s, os.W_OK):
+                raise ArgumentValid('can\'t open {0}: not writable'.format(s))
+        else:
+            d = os.path.dirname(s) or '.'
+            if not os.access(d, os.W_OK):
+                raise ArgumentValid('can\'t open {0}: directory not '
+                                    'writable'.format(s))
+        return s
 
     def __str__(self):
         return '<outfilename>'
@@ -428,22 +469,19 @@ class CephFragment(CephArgtype):
     'Fragment' ??? XXX
     """
     def valid(self, s, partial=False):
-        if s.find('/') == -1:
+        val, sep, bits = s.partition('/')
+        if not sep:
             raise ArgumentFormat('{0}: no /'.format(s))
-        val, bits = s.split('/')
         # XXX is this right?
         if not val.startswith('0x'):
             raise ArgumentFormat("{0} not a hex integer".format(val))
         try:
-            long(val)
-        except:
+            long(val, 16)
+        except ValueError:
             raise ArgumentFormat('can\'t convert {0} to integer'.format(val))
-        try:
-            long(bits)
-        except:
+        if not bits.isdigit():
             raise ArgumentFormat('can\'t convert {0} to integer'.format(bits))
-        self.val = s
-        return True
+        return s
 
     def __str__(self):
         return "<CephFS fragment ID (0xvvv/bbb)>"
@@ -454,12 +492,13 @@ class CephUUID(CephArgtype):
     CephUUID: pretty self-explanatory
     """
     def valid(self, s, partial=False):
-        try:
-            uuid.UUID(s)
-        except Exception as e:
-            raise ArgumentFormat('invalid UUID {0}: {1}'.format(s, e))
-        self.val = s
-        return True
+        # optional urn: and uuid: prefixes, surrounding braces and dashes
+        # anywhere, as uuid.UUID() allows; then exactly 32 hex digits
+        h = s.replace('urn:', '').replace('uuid:', '')
+        h = h.strip('{}').replace('-', '')
+        if not _UUID_RE.match(h):
+            raise ArgumentFormat('invalid UUID {0}'.format(s))
+        return s
 
     def __str__(self):
         return '<uuid>'
@@ -475,18 +514,39 @@ class CephPrefix(CephArgtype):
     def valid(self, s, partial=False):
         if partial:
             if self.prefix.startswith(s):
-                self.val = s
-                return True
+                return s
         else:
             if (s == self.prefix):
-                self.val = s
-                return True
+                return s
         raise ArgumentPrefix("no match for {0}".format(s))
 
+    def check(self, s, partial=False):
+        if partial:
+            return self.prefix.startswith(s)
+        return s == self.prefix
+
     def __str__(self):
         return self.prefix
 
 
+# argument type names as they appear in JSON command descriptions
+_TYPE_MAP = dict([(cls.__name__, cls) for cls in (
+    CephInt, CephFloat, CephString, CephSocketpath, CephIPAddr,
+    CephEntityAddr, CephPoolname, CephObjectname, CephPgid, CephName,
+    CephOsdName, CephChoices, CephFilepath, CephFragment, CephUUID,
+    CephPrefix)])
+
+# argument types whose instances hold nothing but their construction
+# parameters (valid() doesn't modify them), so that argdescs can share
+# one instance per distinct set of parameters.  CephName and CephOsdName
+# record the last name they parsed, so they're left out.
+_STATELESS_TYPES = frozenset([
+    CephInt, CephFloat, CephString, CephSocketpath, CephIPAddr,
+    CephEntityAddr, CephPoolname, CephObjectname, CephPgid, CephChoices,
+    CephFilepath, CephFragment, CephUUID, CephPrefix])
+_FLYWEIGHT = {}
+
+
 class argdesc(object):
     """
     argdesc(typename, name='name', n=numallowed|N,
@@ -502,10 +562,13 @@ class argdesc(object):
     helptext is the associated help for the command
     anything else are arguments to pass to the type constructor.
 
-    self.instance is an instance of type t constructed with typeargs.
+    self.instance is an instance of type t constructed with typeargs
+    (shared with other argdescs with the same t and typeargs, if t
+    is in _STATELESS_TYPES).
 
     valid() will later be called with input to validate against it,
-    and will store the validated value in self.instance.val for extraction.
+    and will return the validated value.  Nothing about a particular
+    validation is stored in the argdesc; see ArgState.
     """
     def __init__(self, t, name=None, n=1, req=True, **kwargs):
         if isinstance(t, types.StringTypes):
@@ -523,11 +586,21 @@ class argdesc(object):
             self.n = 1
         else:
             self.n = int(n)
-        self.instance = self.t(**self.typeargs)
+        if self.t in _STATELESS_TYPES:
+            key = (self.t, frozenset(self.typeargs.items()))
+            self.instance = _FLYWEIGHT.get(key)
+            if self.instance is None:
+                self.instance = self.t(**self.typeargs)
+                _FLYWEIGHT[key] = self.instance
+        else:
+            self.instance = self.t(**self.typeargs)
+        # descriptors don't change once built; cache their string forms
+        self._str = None
+        self._helpstr = None
 
     def __repr__(self):
         r = 'argdesc(' + str(self.t) + ', '
-        internals = ['N', 'typeargs', 'instance', 't']
+        internals = ['N', 'typeargs', 'instance', 't', '_str', '_helpstr']
         for (k,v) in self.__dict__.iteritems():
             if k.startswith('__') or k in internals:
                 pass
@@ -541,15 +614,18 @@ class argdesc(object):
         return r[:-2] + ')'
 
     def __str__(self):
+        if self._str is not None:
+            return self._str
         if ((self.t == CephChoices and len(self.instance.strings) == 1)
             or (self.t == CephPrefix)):
-            s = '{0}'.format(str(self.instance))
+            s = str(self.instance)
         else:
             s = '{0}({1})'.format(self.name, str(self.instance))
             if self.N:
                 s += ' [' + str(self.instance) + '...]'
         if not self.req:
             s = '{' + s + '}'
+        self._str = s
         return s
 
     def helpstr(self):
@@ -557,30 +633,25 @@ class argdesc(object):
         like str(), but omit parameter names (except for CephString,
         which really needs them)
         """
+        if self._helpstr is not None:
+            return self._helpstr
         if self.t == CephString:
             chunk = '<{0}>'.format(self.name)
         else:
             chunk = str(self.instance)
-        s = '{0}'.format(chunk)
+        s = chunk
         if self.N:
             s += ' [' + chunk + '...]'
         if not self.req:
             s = '{' + s + '}'
+        self._helpstr = s
         return s
 
 def concise_sig(sig):
     """
     Return string representation of sig useful for syntax reference in help
     """
-    first = True
-    s = ''
-    for d in sig:
-        if first:
-            first = False
-        else:
-            s += ' '
-        s += d.helpstr()
-    return s
+    return ' '.join([d.helpstr() for d in sig])
 
 def parse_funcsig(sig):
     """
@@ -599,15 +670,10 @@ def parse_funcsig(sig):
             if not 'type' in desc:
                 s = 'JSON descriptor {0} has no type'.format(sig)
                 raise JsonFormat(s)
-            # look up type string in our globals() dict; if it's an
-            # object of type types.TypeType, it must be a
-            # locally-defined class. otherwise, we haven't a clue.
-            if desc['type'] in globals():
-                t = globals()[desc['type']]
-                if type(t) != types.TypeType:
-                    s = 'unknown type {0}'.format(desc['type'])
-                    raise JsonFormat(s)
-            else:
+            # look up type string in our table of argument types;
+            # otherwise, we haven't a clue.
+            t = _TYPE_MAP.get(desc['type'])
+            if t is None:
                 s = 'unknown type {0}'.format(desc['type'])
                 raise JsonFormat(s)
 
@@ -623,6 +689,182 @@ def parse_funcsig(sig):
     return newsig
 
 
+class SigDict(dict):
+    """
+    dict of command signatures keyed by cmdtag, as returned by
+    parse_json_funcsigs().  Also keeps an index of the signatures by
+    their first (CephPrefix) word, so that a command line need only be
+    matched against the signatures that could possibly apply to it,
+    and a cache of validate_command() results.
+    """
+    CACHE_SIZE = 512
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self)
+        self.by_prefix = {}
+        self.prefixes = []
+        self.unprefixed = []
+        self.cache = {}
+        self.update(*args, **kwargs)
+
+    @staticmethod
+    def _prefix(cmd):
+        """
+        first fixed word of cmd's signature, or None if it has none
+        """
+        sig = cmd['sig']
+        if sig and sig[0].t is CephPrefix:
+            return sig[0].instance.prefix
+        return None
+
+    def _index(self, cmdtag, cmd):
+        prefix = self._prefix(cmd)
+        if prefix is None:
+            self.unprefixed.append(cmdtag)
+            return
+        if prefix not in self.by_prefix:
+            self.by_prefix[prefix] = []
+            bisect.insort(self.prefixes, prefix)
+        self.by_prefix[prefix].append(cmdtag)
+
+    def _unindex(self, cmdtag, cmd):
+        prefix = self._prefix(cmd)
+        if prefix is None:
+            self.unprefixed.remove(cmdtag)
+            return
+        tags = self.by_prefix[prefix]
+        tags.remove(cmdtag)
+        if not tags:
+            del self.by_prefix[prefix]
+            del self.prefixes[bisect.bisect_left(self.prefixes, prefix)]
+
+    # every way of changing the contents goes through __setitem__ or
+    # __delitem__, so the index and the cache never go stale
+
+    def __setitem__(self, cmdtag, cmd):
+        if cmdtag in self:
+            self._unindex(cmdtag, self[cmdtag])
+        dict.__setitem__(self, cmdtag, cmd)
+        self._index(cmdtag, cmd)
+        self.cache.clear()
+
+    def __delitem__(self, cmdtag):
+        cmd = self[cmdtag]
+        dict.__delitem__(self, cmdtag)
+        self._unindex(cmdtag, cmd)
+        self.cache.clear()
+
+    def update(self, *args, **kwargs):
+        for cmdtag, cmd in dict(*args, **kwargs).iteritems():
+            self[cmdtag] = cmd
+
+    def setdefault(self, cmdtag, cmd=None):
+        if cmdtag not in self:
+            self[cmdtag] = cmd
+        return self[cmdtag]
+
+    def pop(self, cmdtag, *default):
+        if cmdtag not in self:
+            return dict.pop(self, cmdtag, *default)
+        cmd = self[cmdtag]
+        del self[cmdtag]
+        return cmd
+
+    def popitem(self):
+        if not self:
+            raise KeyError('popitem(): dictionary is empty')
+        cmdtag = next(self.iterkeys())
+        return cmdtag, self.pop(cmdtag)
+
+    def clear(self):
+        dict.clear(self)
+        self.by_prefix.clear()
+        del self.prefixes[:]
+        del self.unprefixed[:]
+        self.cache.clear()
+
+    def add(self, cmdtag, cmd):
+        """
+        add cmd ({'sig':..., 'helptext':...}) as cmdtag, and index it
+        """
+        self[cmdtag] = cmd
+
+    def candidates(self, word, partial=False):
+        """
+        Return the cmdtags of the signatures whose first word may
+        match word (exactly, or begins-with if partial), plus any that
+        don't start with a fixed word.  If none start with word, return
+        all the cmdtags, as then none of them is a better match than any
+        other.
+        """
+        if partial:
+            tags = []
+            i = bisect.bisect_left(self.prefixes, word)
+            while i < len(self.prefixes) and \
+                    self.prefixes[i].startswith(word):
+                tags.extend(self.by_prefix[self.prefixes[i]])
+                i += 1
+        else:
+            tags = list(self.by_prefix.get(word, []))
+        if not tags:
+            return self.keys()
+        return tags + self.unprefixed
+
+    @staticmethod
+    def _copy(valid_dict):
+        """
+        copy of valid_dict, including the lists of N-args, so that
+        neither the caller nor the cache can change the other's
+        """
+        return dict((k, list(v) if isinstance(v, list) else v)
+                    for k, v in valid_dict.iteritems())
+
+    def cached(self, key):
+        """
+        Return a copy of the valid_dict remembered for key, or None
+        """
+        valid_dict = self.cache.get(key)
+        if valid_dict is None:
+            return None
+        return self._copy(valid_dict)
+
+    def remember(self, key, sig, valid_dict):
+        """
+        Remember (a copy of) valid_dict, validated against sig, for key.
+        Results that depend on the local filesystem aren't kept, as it
+        may have changed by the next time.
+        """
+        for desc in sig:
+            if desc.t in (CephFilepath, CephSocketpath):
+                return
+        if len(self.cache) >= self.CACHE_SIZE:
+            self.cache.clear()
+        self.cache[key] = self._copy(valid_dict)
+
+def _json_cmds(s):
+    """
+    Generate the (cmdtag, cmd) pairs of the JSON object in s.  If ijson
+    (with a yajl backend) is available and s is a byte string, the
+    commands are parsed one at a time as they're consumed, rather than
+    building the whole document in memory first.
+    """
+    if getattr(ijson, 'kvitems', None) is None or not isinstance(s, str):
+        try:
+            overall = json.loads(s)
+        except Exception as e:
+            print >> sys.stderr, "Couldn't parse JSON {0}: {1}".format(s, e)
+            raise e
+        for item in overall.iteritems():
+            yield item
+        return
+
+    try:
+        for item in ijson.kvitems(cStringIO.StringIO(s), ''):
+            yield item
+    except IJSONError as e:
+        print >> sys.stderr, "Couldn't parse JSON {0}: {1}".format(s, e)
+        raise e
+
 def parse_json_funcsigs(s):
     """
     parse_json_funcsigs(s)
@@ -647,16 +889,13 @@ def parse_json_funcsigs(s):
     }
 
     Parse the string s and return an dict of dicts, keyed by opcode;
-    each dict contains 'sig' with the array of descriptors, and 'help'
-    with the helptext.
+    each dict contains 'sig' with the array of descriptors, 'help'
+    with the helptext, and 'nreq' with the number of required
+    descriptors.  The returned dict is a SigDict, indexed by the first
+    word of each signature.
     """
-    try:
-        overall = json.loads(s)
-    except Exception as e:
-        print >> sys.stderr, "Couldn't parse JSON {0}: {1}".format(s, e)
-        raise e
-    sigdict = {}
-    for cmdtag, cmd in overall.iteritems():
+    sigdict = SigDict()
+    for cmdtag, cmd in _json_cmds(s):
         helptext = cmd.get('help', 'no help available')
         try:
             sig = cmd['sig']
@@ -664,24 +903,42 @@ def parse_json_funcsigs(s):
             s = "JSON descriptor {0} has no 'sig'".format(cmdtag)
             raise JsonFormat(s)
         newsig = parse_funcsig(sig)
-        sigdict[cmdtag] = {'sig':newsig, 'helptext':helptext}
+        # only required descs count towards matchnum(), once each, so
+        # this is the best score the sig can get
+        nreq = len([desc for desc in newsig if desc.req])
+        sigdict.add(cmdtag, {'sig':newsig, 'helptext':helptext,
+                             'nreq':nreq})
     return sigdict
 
-def validate_one(word, desc, partial=False):
+class ArgState(object):
+    """
+    The state of one validation against one argdesc: how many words
+    it has consumed (numseen), how many it may consume (n, which grows
+    for N descriptors), and the last validated value (val).  Kept apart
+    from the argdesc so that signatures are never modified by
+    validation.
     """
-    validate_one(word, desc, partial=False)
+    __slots__ = ('numseen', 'n', 'val')
+
+    def __init__(self, desc):
+        self.numseen = 0
+        self.n = desc.n
+        self.val = None
+
+def validate_one(word, desc, state, partial=False):
+    """
+    validate_one(word, desc, state, partial=False)
 
     validate word against the constructed instance of the type
-    in desc.  May raise exception.  If it returns false (and doesn't
-    raise an exception), desc.instance.val will
-    contain the validated value (in the appropriate type).
-    """
-    if desc.instance.valid(word, partial):
-        desc.numseen += 1
-        if desc.N:
-            desc.n = desc.numseen + 1
-        return True
-    return False
+    in desc.  May raise exception.  If it returns True (and doesn't
+    raise an exception), state.val will contain the validated value
+    (in the appropriate type), and state's counts will be updated.
+    """
+    state.val = desc.instance.valid(word, partial)
+    state.numseen += 1
+    if desc.N:
+        state.n = state.numseen + 1
+    return True
 
 def matchnum(args, signature, partial=False):
     """
@@ -691,26 +948,31 @@ def matchnum(args, signature, partial=False):
     Can be used to determine most-likely command for full or partial
     matches (partial applies to string matches).
     """
-    words = args[:]
-    mysig = copy.deepcopy(signature)
+    # walk args by index rather than popping words off a copy, and
+    # keep the per-descriptor counts in locals; this is the inner loop
+    # of command lookup
+    nwords = len(args)
+    i = 0
     matchcnt = 0
-    for desc in mysig:
-        setattr(desc, 'numseen', 0)
-        while desc.numseen < desc.n:
+    for desc in signature:
+        check = desc.instance.check
+        numseen = 0
+        n = desc.n
+        while numseen < n:
             # if there are no more arguments, return
-            if not words:
-                return matchcnt;
-            word = words.pop(0)
-            try:
-                validate_one(word, desc, partial)
-            except:
+            if i == nwords:
+                return matchcnt
+            if not check(args[i], partial):
                 if not desc.req:
                     # this wasn't required, so word may match the next desc
-                    words.insert(0, word)
                     break
                 else:
                     # it was required, and didn't match, return
                     return matchcnt
+            i += 1
+            numseen += 1
+            if desc.N:
+                n = numseen + 1
         if desc.req:
             matchcnt += 1
     return matchcnt
@@ -727,33 +989,32 @@ def validate(args, signature, partial=False):
 
     If partial is set, allow partial matching (with partial dict returned)
     """
-    words = args[:]
-    mysig = copy.deepcopy(signature)
+    nwords = len(args)
+    i = 0
     d = dict()
-    for desc in mysig:
-        setattr(desc, 'numseen', 0)
-        while desc.numseen < desc.n:
-            if words:
-                word = words.pop(0)
+    for desc in signature:
+        state = ArgState(desc)
+        while state.numseen < state.n:
+            if i < nwords:
+                word = args[i]
             else:
                 if desc.req:
-                    if desc.N and desc.numseen < 1:
+                    if desc.N and state.numseen < 1:
                         # wanted N, didn't even get 1
                         if partial:
                             return d
-                        raise ArgumentNumber('saw {0} of {1}, expected at least 1'.format(desc.numseen, desc))
-                    elif not desc.N and desc.numseen < desc.n:
+                        raise ArgumentNumber('saw {0} of {1}, expected at least 1'.format(state.numseen, desc))
+                    elif not desc.N and state.numseen < state.n:
                         # wanted n, got too few
                         if partial:
                             return d
-                        raise ArgumentNumber('saw {0} of {1}, expected {2}'.format(desc.numseen, desc, desc.n))
+                        raise ArgumentNumber('saw {0} of {1}, expected {2}'.format(state.numseen, desc, state.n))
                 break
             try:
-                validate_one(word, desc)
+                validate_one(word, desc, state)
             except Exception as e:
-                # not valid; if not required, just push back for the next one
+                # not valid; if not required, leave it for the next one
                 if not desc.req:
-                    words.insert(0, word)
                     break
                 else:
                     # hm, but it was required, so quit
@@ -761,18 +1022,19 @@ def validate(args, signature, partial=False):
                         return d
                     raise e
 
+            i += 1
             if desc.N:
                 # value should be a list
                 if desc.name in d:
-                    d[desc.name] += [desc.instance.val]
+                    d[desc.name] += [state.val]
                 else:
-                    d[desc.name] = [desc.instance.val]
+                    d[desc.name] = [state.val]
             elif (desc.t == CephPrefix) and (desc.name in d):
                 # value should be a space-joined concatenation
-                d[desc.name] += ' ' + desc.instance.val
+                d[desc.name] += ' ' + state.val
             else:
                 # if first CephPrefix or any other type, just set it
-                d[desc.name] = desc.instance.val
+                d[desc.name] = state.val
     return d
 
 def validate_command(parsed_args, sigdict, args, verbose=False):
@@ -784,12 +1046,31 @@ def validate_command(parsed_args, sigdict, args, verbose=False):
     found = []
     valid_dict = {}
     if args:
+        # the same command line is often validated over and over (by
+        # the REST interface, for one), so a SigDict remembers results
+        usecache = isinstance(sigdict, SigDict) and not verbose
+        if usecache:
+            key = (tuple(args), parsed_args.output_format,
+                   parsed_args.threshold)
+            cached = sigdict.cached(key)
+            if cached is not None:
+                return cached
+
         # look for best match, accumulate possibles in bestcmds
         # (so we can maybe give a more-useful error message)
         best_match_cnt = 0
         bestcmds = []
-        for cmdtag, cmd in sigdict.iteritems():
+        if isinstance(sigdict, SigDict):
+            # only bother with sigs that can match the first word
+            cmdtags = sigdict.candidates(args[0], partial=True)
+        else:
+            cmdtags = sigdict.keys()
+        for cmdtag in cmdtags:
+            cmd = sigdict[cmdtag]
             sig = cmd['sig']
+            if cmd.get('nreq', len(sig)) < best_match_cnt:
+                # can't possibly catch up; don't bother scoring it
+                continue
             matched = matchnum(args, sig, partial=True)
             if (matched > best_match_cnt):
                 if verbose:
@@ -845,6 +1126,9 @@ def validate_command(parsed_args, sigdict, args, verbose=False):
         if parsed_args.threshold:
             valid_dict['threshold'] = parsed_args.threshold
 
+        if usecache:
+            sigdict.remember(key, found, valid_dict)
+
         return valid_dict
 
 def send_command(cluster, target=('mon', ''), cmd=[], inbuf='', timeout=0, 
@@ -913,17 +1197,22 @@ def json_command(cluster, target=('mon', ''), prefix=None, argdict=None,
 
     try:
         if target[0] == 'osd':
-            osdtarg = CephName()
             osdtarget = '{0}.{1}'.format(*target)
             # prefer target from cmddict if present and valid
             if 'target' in cmddict:
                 osdtarget = cmddict.pop('target')
-            try:
-                osdtarg.valid(osdtarget)
-                target = ('osd', osdtarg.nameid)
-            except:
-                # use the target we were originally given
-                pass
+            m = _OSD_TARGET_RE.match(osdtarget)
+            if m:
+                target = ('osd', int(m.group(1)))
+            else:
+                # anything else (osd.*, say) needs the full CephName parse
+                osdtarg = CephName()
+                try:
+                    osdtarg.valid(osdtarget)
+                    target = ('osd', osdtarg.nameid)
+                except:
+                    # use the target we were originally given
+                    pass
 
         ret, outbuf, outs = send_command(cluster, target, [json.dumps(cmddict)],
                                          inbuf, timeout, verbose)